@@ -1,14 +1,22 @@
 from pathlib import Path
 from datetime import datetime, timedelta, time as dtime
 
+import pandas as pd
 import streamlit as st
 from streamlit_autorefresh import st_autorefresh
 import plotly.express as px
 
 from devices import load_devices, save_devices, get_device_by_id, group_devices_by_floor
 from get_power_data import fetch_and_log_once
-from tuya_api import control_device, get_token
-from tuya_api_mongo import latest_docs, range_docs, get_client, MONGODB_URI
+from tuya_api import control_device, get_token, invalidate_token, is_token_error
+from tuya_api_mongo import (
+    latest_docs,
+    latest_per_device,
+    range_docs,
+    range_docs_bucketed,
+    get_client,
+    MONGODB_URI,
+)
 from billing import (
     daily_monthly_for,
     aggregate_totals_all_devices,
@@ -22,6 +30,7 @@ from schedules import (
     delete_schedule,
     run_due_schedules,
 )
+from helpers import dhaka_tz, downsample, local_days_to_utc, to_local_time
 import seed_history
 # Page setup
 
@@ -33,6 +42,11 @@ st.set_page_config(
 
 DATA_DIR = Path("data")
 
+# Shared chart layouts, built once instead of on every rerun.
+_TIGHT = dict(margin=dict(l=10, r=10, t=30, b=10))
+_TIGHT_UNTITLED = dict(margin=dict(l=10, r=10, t=10, b=10))
+_TIGHT_TITLED = dict(margin=dict(l=10, r=10, t=40, b=10))
+
 
 st.markdown(
     """
@@ -202,6 +216,15 @@ def go_device(device_id: str, device_name: str):
     st.session_state.page = "device_detail"
 
 
+def switch_device(device_id: str, value: bool) -> dict:
+    res = control_device(device_id, get_token(), "switch_1", value)
+    if is_token_error(res):
+        # Cached token was revoked or expired early; fetch a fresh one once.
+        invalidate_token()
+        res = control_device(device_id, get_token(), "switch_1", value)
+    return res
+
+
 # Sidebar: system status
 
 try:
@@ -263,15 +286,11 @@ def render_top_nav():
         is_active = (current == page_key) or (current == "device_detail" and page_key == "devices")
         btn_label = f"● {label}" if is_active else label
         with cols[idx]:
-            if st.button(btn_label, key=f"topnav_{page_key}"):
-                go(page_key)
-                st.rerun()
+            st.button(btn_label, key=f"topnav_{page_key}", on_click=go, args=(page_key,))
 
     # Help button aligned right
     with cols[-1]:
-        if st.button("Help / Manual", key="topnav_help"):
-            go("help")
-            st.rerun()
+        st.button("Help / Manual", key="topnav_help", on_click=go, args=("help",))
 
 
 # Pages
@@ -361,7 +380,7 @@ def home_page():
         col_l, col_r = st.columns([3, 1])
         with col_l:
             st.markdown("#### Last 24 hours (building profile)")
-            ts = aggregate_timeseries_24h(devices, resample_rule="5T")
+            ts = to_local_time(aggregate_timeseries_24h(devices, resample_rule="5min"))
             if ts.empty:
                 st.info(
                     "No historical data in MongoDB yet.\n\n"
@@ -370,22 +389,18 @@ def home_page():
                 )
             else:
                 fig = px.line(
-                    ts,
+                    downsample(ts, "power_sum_W"),
                     x="timestamp",
                     y=["power_sum_W", "voltage_avg_V"],
                     labels={"value": "Value", "variable": "Metric"},
                 )
-                fig.update_layout(margin=dict(l=10, r=10, t=30, b=10), legend_title_text="")
+                fig.update_layout(_TIGHT, legend_title_text="")
                 st.plotly_chart(fig, use_container_width=True)
 
         with col_r:
             st.markdown("#### Quick actions")
-            if st.button("View devices list"):
-                go("devices")
-                st.rerun()
-            if st.button("Add new plug"):
-                go("add_device")
-                st.rerun()
+            st.button("View devices list", on_click=go, args=("devices",))
+            st.button("Add new plug", on_click=go, args=("add_device",))
             st.markdown("---")
             st.markdown(
                 '<span class="pill">Connected plugs: '
@@ -395,7 +410,7 @@ def home_page():
 
     # -------------------- HISTORY TAB --------------------
     with tabs[1]:
-        today = datetime.now().date()
+        today = datetime.now(dhaka_tz).date()
         hist_date = st.date_input(
             "Select date",
             value=today,
@@ -403,18 +418,20 @@ def home_page():
         )
         st.caption("Data will be cleared while extra load.")
 
-        h_ts = aggregate_timeseries_for_day(devices, hist_date, resample_rule="15T")
+        h_ts = to_local_time(
+            aggregate_timeseries_for_day(devices, hist_date, resample_rule="15min")
+        )
         if h_ts.empty:
             st.info("No data recorded for this day yet.")
         else:
             h_fig = px.line(
-                h_ts,
+                downsample(h_ts, "power_sum_W"),
                 x="timestamp",
                 y=["power_sum_W", "voltage_avg_V"],
                 labels={"value": "Value", "variable": "Metric"},
                 title=f"Building profile for {hist_date.isoformat()}",
             )
-            h_fig.update_layout(margin=dict(l=10, r=10, t=40, b=10), legend_title_text="")
+            h_fig.update_layout(_TIGHT_TITLED, legend_title_text="")
             st.plotly_chart(h_fig, use_container_width=True)
 
 
@@ -430,6 +447,8 @@ def devices_page():
         st.info("No devices found. Use **Add device** from the top navigation.")
         return
 
+    latest = latest_per_device([d["id"] for d in devs])
+
     for d in devs:
         building = d.get("building", "FUB")
         floor = d.get("floor", "?")
@@ -444,9 +463,8 @@ def devices_page():
                     unsafe_allow_html=True,
                 )
             with col2:
-                df_recent = latest_docs(d["id"], n=1)
-                if not df_recent.empty:
-                    row = df_recent.iloc[-1]
+                row = latest.get(d["id"])
+                if row:
                     st.caption(
                         f"Last: {row.get('power', 0):.1f} W @ "
                         f"{row.get('voltage', 0):.1f} V"
@@ -454,9 +472,12 @@ def devices_page():
                 else:
                     st.caption("No readings stored yet.")
             with col3:
-                if st.button("Open dashboard", key=f"view_{d['id']}"):
-                    go_device(d["id"], d.get("name", "Device"))
-                    st.rerun()
+                st.button(
+                    "Open dashboard",
+                    key=f"view_{d['id']}",
+                    on_click=go_device,
+                    args=(d["id"], d.get("name", "Device")),
+                )
         st.markdown("---")
 
 
@@ -503,20 +524,30 @@ def manage_devices_page():
         st.info("No devices to manage yet.")
         return
 
-    to_keep = []
-    for d in devs:
-        col1, col2 = st.columns([5, 1])
-        with col1:
-            st.write(
-                f"**{d.get('name','(no name)')}** – `{d.get('id')}` "
-                f"({d.get('building','FUB')} · Floor {d.get('floor','?')} · Room {d.get('room','?')})"
-            )
-        with col2:
-            keep = not st.checkbox("Delete", key=f"del_{d['id']}")
-        if keep:
-            to_keep.append(d)
+    table = pd.DataFrame(
+        [
+            {
+                "Delete": False,
+                "Name": d.get("name", "(no name)"),
+                "Id": d.get("id"),
+                "Building": d.get("building", "FUB"),
+                "Floor": d.get("floor", "?"),
+                "Room": d.get("room", "?"),
+            }
+            for d in devs
+        ]
+    )
+    edited = st.data_editor(
+        table,
+        num_rows="fixed",
+        hide_index=True,
+        disabled=["Name", "Id", "Building", "Floor", "Room"],
+        key="devmgr",
+    )
 
     if st.button("Save changes"):
+        # Rows stay aligned with devs, so the full device records are kept.
+        to_keep = [d for d, delete in zip(devs, edited["Delete"]) if not delete]
         save_devices(to_keep)
         st.success("Device list updated.")
 
@@ -557,9 +588,7 @@ def _render_schedule_editor(device_id: str, dev_meta: dict):
                     key=f"sch_active_{sid}",
                 )
                 update_schedule_active(sid, toggle)
-                if st.button("🗑", key=f"sch_del_{sid}"):
-                    delete_schedule(sid)
-                    st.experimental_rerun()
+                st.button("🗑", key=f"sch_del_{sid}", on_click=delete_schedule, args=(sid,))
 
     st.markdown("#### Add new schedule")
 
@@ -599,7 +628,7 @@ def _render_schedule_editor(device_id: str, dev_meta: dict):
         )
         if sid:
             st.success("Schedule created.")
-            st.experimental_rerun()
+            st.rerun()
         else:
             st.error("Failed to create schedule. Check Mongo connection.")
 
@@ -635,11 +664,12 @@ def device_detail_page():
 
     # -------------------- TODAY TAB --------------------
     with tabs[0]:
+        # One query serves both the snapshot and the recent-power chart.
+        df_recent = to_local_time(latest_docs(dev_id, n=50))
         top1, top2 = st.columns([2, 1])
 
         with top1:
             st.markdown("#### Live snapshot")
-            df_recent = latest_docs(dev_id, n=20)
             if not df_recent.empty:
                 last = df_recent.iloc[-1]
                 c1, c2, c3 = st.columns(3)
@@ -657,20 +687,17 @@ def device_detail_page():
             c1, c2 = st.columns(2)
             with c1:
                 if st.button("Turn ON"):
-                    token = get_token()
-                    res = control_device(dev_id, token, "switch_1", True)
+                    res = switch_device(dev_id, True)
                     st.json(res)
             with c2:
                 if st.button("Turn OFF"):
-                    token = get_token()
-                    res = control_device(dev_id, token, "switch_1", False)
+                    res = switch_device(dev_id, False)
                     st.json(res)
 
         st.markdown("### Recent power (last 50 samples)")
-        df_recent = latest_docs(dev_id, n=50)
         if not df_recent.empty:
             fig = px.line(df_recent, x="timestamp", y="power", title="")
-            fig.update_layout(margin=dict(l=10, r=10, t=10, b=10))
+            fig.update_layout(_TIGHT_UNTITLED)
             st.plotly_chart(fig, use_container_width=True)
         else:
             st.info("No data yet. Leave this page open for a few refresh cycles.")
@@ -690,7 +717,7 @@ def device_detail_page():
 
         st.markdown("### Historical Analysis by Date Range")
         c1, c2, c3 = st.columns(3)
-        today = datetime.now().date()
+        today = datetime.now(dhaka_tz).date()
         with c1:
             start_date = st.date_input(
                 "Start date", value=today - timedelta(days=1), max_value=today
@@ -700,24 +727,24 @@ def device_detail_page():
         with c3:
             agg = st.selectbox("Aggregation", ["raw", "1-min", "5-min", "15-min"], index=2)
 
-        start_dt = datetime.combine(start_date, datetime.min.time())
-        end_dt = datetime.combine(end_date, datetime.max.time())
-        df = range_docs(dev_id, start_dt, end_dt)
-
-        if not df.empty:
-            df = df.sort_values("timestamp").set_index("timestamp")
-            if agg != "raw":
-                rule = {"1-min": "1T", "5-min": "5T", "15-min": "15T"}[agg]
-                df = df.resample(rule).mean(numeric_only=True).dropna()
+        start_dt, end_dt = local_days_to_utc(start_date, end_date)
+        if agg == "raw":
+            plot_df = range_docs(dev_id, start_dt, end_dt)
+        else:
+            # Bucket averages are computed in Mongo, so only one row per bucket
+            # crosses the wire.
+            seconds = {"1-min": 60, "5-min": 300, "15-min": 900}[agg]
+            plot_df = range_docs_bucketed(dev_id, start_dt, end_dt, seconds).dropna()
 
-            plot_df = df.reset_index()
+        if not plot_df.empty:
+            plot_df = to_local_time(plot_df)
             fig = px.line(
-                plot_df,
+                downsample(plot_df, "power"),
                 x="timestamp",
                 y="power",
                 title=f"Power over time ({agg})",
             )
-            fig.update_layout(margin=dict(l=10, r=10, t=30, b=10))
+            fig.update_layout(_TIGHT)
             st.plotly_chart(fig, use_container_width=True)
             st.expander("Raw Data").dataframe(plot_df.tail(200))
         else:
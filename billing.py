@@ -1,9 +1,11 @@
 from datetime import datetime, timedelta, timezone
 from typing import List, Dict, Tuple
 
+import numpy as np
 import pandas as pd
+from pandas.tseries.frequencies import to_offset
 
-from tuya_api_mongo import range_docs, latest_docs
+from tuya_api_mongo import energy_bounds_per_device, latest_per_device, range_arrays
 from helpers import dhaka_tz
 
 
@@ -39,10 +41,10 @@ def _bd_domestic_bill(units_kwh: float) -> float:
     return round(total, 2)
 
 
-def _units_between(df: pd.DataFrame) -> float:
-    if df.empty or "energy_kWh" not in df.columns:
+def _units_between(lo, hi) -> float:
+    if lo is None or hi is None:
         return 0.0
-    return float(df["energy_kWh"].max() - df["energy_kWh"].min())
+    return float(hi - lo)
 
 
 def _day_window_local(now=None) -> Tuple[datetime, datetime]:
@@ -78,33 +80,21 @@ def _month_window_local(now=None) -> Tuple[datetime, datetime]:
 
 def daily_monthly_for(device_id: str):
     now = datetime.now(dhaka_tz)
+    day_start, day_end = _day_window_local(now)
+    m_start, m_end = _month_window_local(now)
+    b = energy_bounds_per_device([device_id], day_start, day_end, m_start, m_end).get(device_id, {})
 
     # Today
-    day_start, day_end = _day_window_local(now)
-    ddf = range_docs(device_id, day_start, day_end)
-    d_units = round(_units_between(ddf), 3)
+    d_units = round(_units_between(b.get("day_min"), b.get("day_max")), 3)
     d_cost = _bd_domestic_bill(d_units)
 
     # Month
-    m_start, m_end = _month_window_local(now)
-    mdf = range_docs(device_id, m_start, m_end)
-    m_units = round(_units_between(mdf), 3)
+    m_units = round(_units_between(b.get("month_min"), b.get("month_max")), 3)
     m_cost = _bd_domestic_bill(m_units)
 
     return d_units, d_cost, m_units, m_cost
 
 
-def _latest_power_voltage(device_id: str):
-    df = latest_docs(device_id, n=1)
-    if df.empty:
-        return 0.0, None
-    row = df.iloc[-1]
-    p = float(row.get("power", 0) or 0)
-    v = row.get("voltage", None)
-    v = float(v) if v is not None else None
-    return p, v
-
-
 def aggregate_totals_all_devices(devices: List[Dict]) -> tuple:
 
     dev_ids = [d["id"] if isinstance(d, dict) else d for d in devices]
@@ -112,30 +102,28 @@ def aggregate_totals_all_devices(devices: List[Dict]) -> tuple:
     # Instant totals
     total_power_now = 0.0
     latest_voltages = []
-    for did in dev_ids:
-        p, v = _latest_power_voltage(did)
-        total_power_now += p
-        if v is not None:
-            latest_voltages.append(float(v))
+    for doc in latest_per_device(dev_ids).values():
+        total_power_now += float(doc.get("power", 0) or 0)
+        if doc.get("voltage") is not None:
+            latest_voltages.append(float(doc["voltage"]))
     present_voltage = round(max(latest_voltages), 2) if latest_voltages else 0.0
 
     now = datetime.now(dhaka_tz)
+    day_start, day_end = _day_window_local(now)
+    m_start, m_end = _month_window_local(now)
+    bounds = energy_bounds_per_device(dev_ids, day_start, day_end, m_start, m_end)
 
     # Today totals
-    day_start, day_end = _day_window_local(now)
     total_kwh_today = 0.0
-    for did in dev_ids:
-        ddf = range_docs(did, day_start, day_end)
-        total_kwh_today += _units_between(ddf)
+    for b in bounds.values():
+        total_kwh_today += _units_between(b.get("day_min"), b.get("day_max"))
     total_kwh_today = round(total_kwh_today, 3)
     today_bill_bdt = _bd_domestic_bill(total_kwh_today)
 
     # Month totals
-    m_start, m_end = _month_window_local(now)
     total_kwh_month = 0.0
-    for did in dev_ids:
-        mdf = range_docs(did, m_start, m_end)
-        total_kwh_month += _units_between(mdf)
+    for b in bounds.values():
+        total_kwh_month += _units_between(b.get("month_min"), b.get("month_max"))
     total_kwh_month = round(total_kwh_month, 3)
     month_bill_bdt = _bd_domestic_bill(total_kwh_month)
 
@@ -149,45 +137,76 @@ def aggregate_totals_all_devices(devices: List[Dict]) -> tuple:
     )
 
 
-def aggregate_timeseries_24h(devices: List[Dict], resample_rule: str = "5T") -> pd.DataFrame:
-    dev_ids = [d["id"] if isinstance(d, dict) else d for d in devices]
-    end = datetime.now()
-    start = end - timedelta(hours=24)
+def _bucket_mean(idx, values, n_buckets: int):
+    ok = ~np.isnan(values)
+    counts = np.bincount(idx[ok], minlength=n_buckets)
+    totals = np.bincount(idx[ok], weights=values[ok], minlength=n_buckets)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return totals / counts
+
+
+def _aggregate_timeseries(
+    dev_ids: List[str], start: datetime, end: datetime, resample_rule: str
+) -> pd.DataFrame:
+    # Buckets are aligned to the epoch, which matches pandas' default
+    # midnight-anchored resample bins for any rule that divides a day.
+    bucket_ns = to_offset(resample_rule).nanos
+    origin = np.datetime64(start, "ns").astype(np.int64) // bucket_ns * bucket_ns
+    n_buckets = int((np.datetime64(end, "ns").astype(np.int64) - origin) // bucket_ns) + 1
+
+    power_sum = np.zeros(n_buckets)
+    power_devs = np.zeros(n_buckets, dtype=np.int64)
+    voltage_sum = np.zeros(n_buckets)
+    voltage_devs = np.zeros(n_buckets, dtype=np.int64)
 
-    frames = []
     for did in dev_ids:
-        df = range_docs(did, start, end)
-        if df.empty:
-            continue
-        cols = [c for c in ["timestamp", "power", "voltage"] if c in df.columns]
-        if "timestamp" not in cols:
+        # Per-device bucket means come back from Mongo; the bincount below
+        # then only aligns them onto the shared bucket grid.
+        arrays = range_arrays(did, start, end, bucket_seconds=bucket_ns // 10**9)
+        if not arrays:
             continue
-        df = df[cols].sort_values("timestamp").set_index("timestamp")
-        df = df.resample(resample_rule).mean(numeric_only=True)
-        frames.append(df)
-
-    if not frames:
+        ts_ns = arrays["timestamp"].astype("datetime64[ns]").astype(np.int64)
+        idx = np.clip((ts_ns - origin) // bucket_ns, 0, n_buckets - 1)
+
+        # Per-device bucket mean, then summed (power) / averaged (voltage)
+        # across the devices that reported in that bucket.
+        for col, acc, devs in (
+            ("power", power_sum, power_devs),
+            ("voltage", voltage_sum, voltage_devs),
+        ):
+            mean = _bucket_mean(idx, arrays[col], n_buckets)
+            seen = ~np.isnan(mean)
+            acc[seen] += mean[seen]
+            devs += seen
+
+    keep = (power_devs > 0) | (voltage_devs > 0)
+    if not keep.any():
         return pd.DataFrame(columns=["timestamp", "power_sum_W", "voltage_avg_V"])
 
-    aligned = pd.concat(frames, axis=1, keys=range(len(frames)))
-    power_cols = [c for c in aligned.columns if c[1] == "power"]
-    voltage_cols = [c for c in aligned.columns if c[1] == "voltage"]
+    with np.errstate(invalid="ignore", divide="ignore"):
+        voltage_avg = voltage_sum / voltage_devs
+    timestamps = (origin + np.arange(n_buckets, dtype=np.int64) * bucket_ns).astype("datetime64[ns]")
 
-    out = pd.DataFrame(
+    return pd.DataFrame(
         {
-            "power_sum_W": aligned[power_cols].sum(axis=1, min_count=1),
-            "voltage_avg_V": aligned[voltage_cols].mean(axis=1),
+            "timestamp": timestamps[keep],
+            "power_sum_W": np.where(power_devs > 0, power_sum, np.nan)[keep],
+            "voltage_avg_V": voltage_avg[keep],
         }
     )
-    out = out.dropna(how="all")
-    out = out.reset_index().rename(columns={"index": "timestamp"})
-    return out
+
+
+def aggregate_timeseries_24h(devices: List[Dict], resample_rule: str = "5min") -> pd.DataFrame:
+    dev_ids = [d["id"] if isinstance(d, dict) else d for d in devices]
+    end = datetime.now(timezone.utc).replace(tzinfo=None)
+    start = end - timedelta(hours=24)
+    return _aggregate_timeseries(dev_ids, start, end, resample_rule)
 
 
 def aggregate_timeseries_for_day(
     devices: List[Dict],
     day_local,
-    resample_rule: str = "5T",
+    resample_rule: str = "5min",
 ) -> pd.DataFrame:
     if not devices:
         return pd.DataFrame(columns=["timestamp", "power_sum_W", "voltage_avg_V"])
@@ -204,31 +223,4 @@ def aggregate_timeseries_for_day(
     end = end_local.astimezone(timezone.utc).replace(tzinfo=None)
 
     dev_ids = [d["id"] if isinstance(d, dict) else d for d in devices]
-    frames = []
-    for did in dev_ids:
-        df = range_docs(did, start, end)
-        if df.empty:
-            continue
-        cols = [c for c in ["timestamp", "power", "voltage"] if c in df.columns]
-        if "timestamp" not in cols:
-            continue
-        df = df[cols].sort_values("timestamp").set_index("timestamp")
-        df = df.resample(resample_rule).mean(numeric_only=True)
-        frames.append(df)
-
-    if not frames:
-        return pd.DataFrame(columns=["timestamp", "power_sum_W", "voltage_avg_V"])
-
-    aligned = pd.concat(frames, axis=1, keys=range(len(frames)))
-    power_cols = [c for c in aligned.columns if c[1] == "power"]
-    voltage_cols = [c for c in aligned.columns if c[1] == "voltage"]
-
-    out = pd.DataFrame(
-        {
-            "power_sum_W": aligned[power_cols].sum(axis=1, min_count=1),
-            "voltage_avg_V": aligned[voltage_cols].mean(axis=1),
-        }
-    )
-    out = out.dropna(how="all")
-    out = out.reset_index().rename(columns={"index": "timestamp"})
-    return out
+    return _aggregate_timeseries(dev_ids, start, end, resample_rule)
@@ -36,7 +36,7 @@ def main():
                     print("[collector] Skipping device with missing 'id':", d)
                     continue
                 try:
-                    result = fetch_and_log_once(dev_id, dev_name)
+                    result = fetch_and_log_once(dev_id, dev_name, min_interval=0, wait=False)
                     now_local = datetime.now(timezone.utc).astimezone(dhaka_tz)
                     print(
                         f"[collector] {now_local.isoformat(timespec='seconds')} | "
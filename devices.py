@@ -1,21 +1,25 @@
-import json
 from pathlib import Path
 from typing import List, Dict, Optional
 
+import orjson
+import streamlit as st
+
 DEVICES_JSON_PATH = Path("devices.json")
 
 
+@st.cache_data(ttl=60, show_spinner=False)
 def load_devices() -> List[Dict]:
     if not DEVICES_JSON_PATH.exists():
         return []
     try:
-        return json.loads(DEVICES_JSON_PATH.read_text(encoding="utf-8"))
+        return orjson.loads(DEVICES_JSON_PATH.read_bytes())
     except Exception:
         return []
 
 
 def save_devices(devs: List[Dict]) -> None:
-    DEVICES_JSON_PATH.write_text(json.dumps(devs, indent=4), encoding="utf-8")
+    DEVICES_JSON_PATH.write_bytes(orjson.dumps(devs, option=orjson.OPT_INDENT_2))
+    load_devices.clear()
 
 
 def get_device_by_id(device_id: str) -> Optional[Dict]:
@@ -1,19 +1,94 @@
-from tuya_api import get_token, get_device_status
+import logging
+import threading
+import time
+from typing import Dict
+
+from tuya_api import get_token, get_device_status, invalidate_token, is_token_error
 from tuya_api_mongo import insert_reading
 from helpers import parse_metrics, build_doc
 
+log = logging.getLogger(__name__)
+log.setLevel(logging.INFO)
+
+# Viewers of the same device share one Tuya poll per window.
+MIN_FETCH_INTERVAL = 20.0  # seconds
+
+_LOCK = threading.Lock()
+_LAST_FETCH: Dict[str, float] = {}
+_LAST_RESULT: Dict[str, dict] = {}
+
+
+class _InFlight:
+    # One running poll per device; concurrent callers wait on it and share
+    # its outcome instead of hitting Tuya themselves.
+    __slots__ = ("done", "result", "error")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
 
-def fetch_and_log_once(device_id: str, device_name: str = ""):
+_IN_FLIGHT: Dict[str, _InFlight] = {}
+
+
+def _poll(device_id: str, device_name: str, wait: bool) -> dict:
     token = get_token()
     raw = get_device_status(device_id, token)
+    if is_token_error(raw):
+        invalidate_token()
+        raw = get_device_status(device_id, get_token())
+
+    log.debug("raw=%s", raw)
 
     if not raw.get("success"):
-        print("Tuya API error:", raw)
+        log.warning("Tuya API error: %s", raw)
         return {"error": raw}
 
     v, c, p, e = parse_metrics(raw)
-    print("Parsed metrics:", v, c, p, e)
+    log.debug("parsed v=%s c=%s p=%s e=%s", v, c, p, e)
 
     doc = build_doc(device_id, device_name, v, c, p, e)
-    insert_reading(device_id, doc)
+    insert_reading(device_id, doc, wait=wait)
     return {"ok": True, "row": doc, "raw": raw}
+
+
+def fetch_and_log_once(
+    device_id: str,
+    device_name: str = "",
+    min_interval: float = MIN_FETCH_INTERVAL,
+    wait: bool = True,
+):
+    # wait=True stores the reading before returning so the caller can read it
+    # back; the collector passes wait=False to use the batched writer.
+    now = time.monotonic()
+    with _LOCK:
+        cached = _LAST_RESULT.get(device_id)
+        if cached is not None and now - _LAST_FETCH.get(device_id, 0.0) < min_interval:
+            return cached
+        poll = _IN_FLIGHT.get(device_id)
+        owner = poll is None
+        if owner:
+            poll = _IN_FLIGHT[device_id] = _InFlight()
+
+    if not owner:
+        # Cold start or retry after a failure: someone is already polling.
+        poll.done.wait()
+        if poll.error is not None:
+            raise poll.error
+        return poll.result
+
+    try:
+        poll.result = _poll(device_id, device_name, wait)
+    except BaseException as e:
+        poll.error = e
+        raise
+    finally:
+        with _LOCK:
+            # Only successes open a window; after a failure the next caller retries.
+            if poll.result is not None and poll.result.get("ok"):
+                _LAST_RESULT[device_id] = poll.result
+                _LAST_FETCH[device_id] = now
+            del _IN_FLIGHT[device_id]
+        poll.done.set()
+    return poll.result
@@ -1,7 +1,8 @@
-import json
 import os
 from datetime import datetime, timedelta, timezone
 
+import numpy as np
+import orjson
 import streamlit as st
 
 
@@ -12,26 +13,84 @@ DEVICE_FILE = "devices.json"
 
 def parse_metrics(status_json: dict):
 
-    result = status_json.get("result", [])
-    m = {x.get("code"): x.get("value") for x in result}
+    raw_voltage = raw_power = raw_current = raw_add_ele = 0
+    need = 4
+    for x in status_json.get("result", ()):
+        # Malformed data points (no code / no value) are skipped, not fatal.
+        code = x.get("code")
+        if code == "cur_voltage":
+            raw_voltage = x.get("value")
+        elif code == "cur_power":
+            raw_power = x.get("value")
+        elif code == "cur_current":
+            raw_current = x.get("value")
+        elif code == "add_ele":
+            raw_add_ele = x.get("value")
+        else:
+            continue
+        need -= 1
+        if not need:
+            break
+
+    voltage = (raw_voltage or 0) / 10.0
+    power = (raw_power or 0) / 10.0
+    current = (raw_current or 0) / 1000.0
+    energy_kwh = (raw_add_ele or 0) / 1000.0
 
-    raw_voltage = m.get("cur_voltage") or 0
-    raw_power = m.get("cur_power") or 0
-    raw_current = m.get("cur_current") or 0
-    raw_add_ele = m.get("add_ele") or 0
+    return voltage, current, power, energy_kwh
 
-    voltage = raw_voltage / 10.0
-    power = raw_power / 10.0
-    current = raw_current / 1000.0
-    energy_kwh = raw_add_ele / 1000.0
 
-    return voltage, current, power, energy_kwh
+def local_days_to_utc(start_day, end_day):
+    # Readings are stored as naive UTC; turn a Dhaka calendar-day range into
+    # matching query bounds.
+    start_local = datetime.combine(start_day, datetime.min.time(), tzinfo=dhaka_tz)
+    end_local = datetime.combine(end_day, datetime.max.time(), tzinfo=dhaka_tz)
+    return (
+        start_local.astimezone(timezone.utc).replace(tzinfo=None),
+        end_local.astimezone(timezone.utc).replace(tzinfo=None),
+    )
+
+
+def to_local_time(df, col: str = "timestamp"):
+    import pandas as pd
+
+    if df.empty or col not in df.columns:
+        return df
+    ts = pd.to_datetime(df[col]).dt.tz_localize("UTC").dt.tz_convert(dhaka_tz)
+    return df.assign(**{col: ts})
+
+
+def downsample(df, col: str, n: int = 2000):
+    # Largest-Triangle-Three-Buckets on row position: keeps at most n rows
+    # while preserving the visual shape of df[col] (peaks survive).
+    size = len(df)
+    if n < 3 or size <= n:
+        return df
+
+    y = np.nan_to_num(df[col].to_numpy(dtype=np.float64))
+    every = (size - 2) / (n - 2)
+    keep = np.empty(n, dtype=np.int64)
+    keep[0], keep[-1] = 0, size - 1
+
+    a = 0
+    for i in range(n - 2):
+        start = int(i * every) + 1
+        end = int((i + 1) * every) + 1
+        next_end = min(int((i + 2) * every) + 1, size)
+        avg_x = (end + next_end - 1) / 2.0
+        avg_y = y[end:next_end].mean()
+        xs = np.arange(start, end)
+        area = np.abs((a - avg_x) * (y[start:end] - y[a]) - (a - xs) * (avg_y - y[a]))
+        a = start + int(area.argmax())
+        keep[i + 1] = a
+
+    return df.iloc[keep]
 
 
 def build_doc(device_id: str, device_name: str, v: float, c: float, p: float, e: float):
 
     return {
-        "timestamp": datetime.now(dhaka_tz),
+        "timestamp": datetime.now(timezone.utc),
         "device_id": device_id,
         "device_name": device_name or "",
         "voltage": v,
@@ -43,13 +102,26 @@ def build_doc(device_id: str, device_name: str, v: float, c: float, p: float, e:
 
 
 
+# ((mtime_ns, size), devices) of the last devices.json read, so the collector
+# can call load_devices_local every cycle without re-parsing an unchanged file.
+_devices_cache = None
+
+
 def load_devices_local():
-    if not os.path.exists(DEVICE_FILE):
+    global _devices_cache
+    try:
+        info = os.stat(DEVICE_FILE)
+    except FileNotFoundError:
+        _devices_cache = None
         return []
-    with open(DEVICE_FILE, "r", encoding="utf-8") as f:
-        return json.load(f)
+    key = (info.st_mtime_ns, info.st_size)
+    if _devices_cache is None or _devices_cache[0] != key:
+        with open(DEVICE_FILE, "rb") as f:
+            _devices_cache = (key, orjson.loads(f.read()))
+    # Hand out copies so callers editing the list can't alter the cache.
+    return [dict(d) for d in _devices_cache[1]]
 
 
 def save_devices_local(devices):
-    with open(DEVICE_FILE, "w", encoding="utf-8") as f:
-        json.dump(devices, f, indent=4)
+    with open(DEVICE_FILE, "wb") as f:
+        f.write(orjson.dumps(devices, option=orjson.OPT_INDENT_2))
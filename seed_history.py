@@ -4,7 +4,8 @@ seed_history.py
 One-shot synthetic history seeding for demo purposes.
 
 How it works:
-- When imported, it checks a 'meta' collection in MongoDB.
+- When imported, it checks a local .seed_done marker, then a 'meta'
+  collection in MongoDB.
 - If seeding has not been done, it generates 5 days of realistic readings
   for the given DEVICE_ID and inserts them into readings_<DEVICE_ID>.
 - Then it writes a flag so it will NOT run again on future imports.
@@ -14,10 +15,11 @@ SAFE to leave in the repo; after first run it does nothing.
 
 import os
 from datetime import datetime, timedelta
-import random
 
-from dotenv import load_dotenv
-from pymongo import MongoClient
+import numpy as np
+from pymongo.write_concern import WriteConcern
+
+from tuya_api_mongo import get_readings_collection
 
 # -------------------------------------------------------
 # CONFIG — CHANGE THESE VALUES
@@ -36,74 +38,73 @@ STEP_MINUTES = 5
 # Typical line voltage in your building (Volts)
 BASE_VOLTAGE = 230.0
 
+# Documents per insert_many call
+INSERT_CHUNK = 10_000
+
+# Local marker (next to devices.json) so later starts skip the Mongo check
+SEED_MARKER = ".seed_done"
+
+# Base power (W) for each hour of the day: very low at night, warm-up,
+# classes / lab, peak hours, evening, late night.
+_HOUR_BASE = np.array(
+    [8.0] * 6 + [70.0] * 3 + [130.0] * 3 + [170.0] * 5 + [90.0] * 5 + [20.0] * 2
+)
+
+# Fixed seed so every fresh database gets the same demo history
+SEED = 42
+rng = np.random.default_rng(SEED)
+
 # -------------------------------------------------------
 # MONGODB CONNECTION
 # -------------------------------------------------------
 
-load_dotenv()  # for local dev; on Streamlit Cloud it just ignores if no .env
-
-MONGODB_URI = os.getenv("MONGODB_URI")
-MONGODB_DB = os.getenv("MONGODB_DB", "tuya_energy")
+def _get_collections():
+    """Readings and meta collections on the shared app client (None if unset)."""
+    readings_coll = get_readings_collection(DEVICE_ID)
+    if readings_coll is None:
+        return None, None
+    return readings_coll, readings_coll.database["meta"]
 
-if not MONGODB_URI:
-    # On Streamlit Cloud this will show in logs if secrets not set.
-    print("[seed_history] MONGODB_URI not set; skipping seeding.")
-    SEED_OK = False
-else:
-    client = MongoClient(MONGODB_URI, tls=True)
-    db = client[MONGODB_DB]
-    readings_coll = db[f"readings_{DEVICE_ID}"]
-    meta_coll = db["meta"]
-    SEED_OK = True
 
-
-def _already_seeded() -> bool:
+def _already_seeded(meta_coll) -> bool:
     """Check meta collection for 'history_seed_done' flag."""
-    if not SEED_OK:
-        return True
     doc = meta_coll.find_one({"_id": "history_seed_done"})
     return bool(doc and doc.get("done"))
 
 
-def _mark_seeded():
+def _touch_marker():
+    try:
+        with open(SEED_MARKER, "a"):
+            pass
+    except OSError as e:
+        print(f"[seed_history] Could not write {SEED_MARKER}: {e}")
+
+
+def _mark_seeded(meta_coll):
     """Set flag so we don't reseed on every import."""
-    if not SEED_OK:
-        return
     meta_coll.update_one(
         {"_id": "history_seed_done"},
         {"$set": {"done": True, "at": datetime.utcnow()}},
         upsert=True,
     )
+    _touch_marker()
 
 
-def power_profile_for_minute(minute_of_day: int) -> float:
+def power_profile(minutes_of_day: np.ndarray, rng: np.random.Generator) -> np.ndarray:
     """
-    Return a realistic power value (W) based on time of day.
+    Return realistic power values (W) for an array of times of day.
 
-    minute_of_day: 0..1439 (0 = 00:00, 1439 = 23:59)
+    minutes_of_day: values in 0..1439 (0 = 00:00, 1439 = 23:59)
     """
-    hour = minute_of_day // 60
-
-    # Base profiles:
-    if 0 <= hour < 6:
-        base = 8      # very low at night
-    elif 6 <= hour < 9:
-        base = 70     # warm-up
-    elif 9 <= hour < 12:
-        base = 130    # classes / lab
-    elif 12 <= hour < 17:
-        base = 170    # peak hours
-    elif 17 <= hour < 22:
-        base = 90     # evening
-    else:
-        base = 20     # late night
+    base = _HOUR_BASE[minutes_of_day // 60]
+    n = len(base)
 
     # Random variation around base
-    noise = random.uniform(-0.25, 0.25) * base
-    p = max(0.0, base + noise)
+    noise = rng.uniform(-0.25, 0.25, n) * base
+    p = np.maximum(0.0, base + noise)
 
     # Slight daily variation (0.9x - 1.1x)
-    day_factor = 0.9 + random.random() * 0.2
+    day_factor = 0.9 + rng.random(n) * 0.2
     return p * day_factor
 
 
@@ -115,51 +116,57 @@ def generate_docs():
     start_date = today - timedelta(days=PAST_DAYS)
     end_date = today - timedelta(days=1)
 
-    docs = []
-    energy_kwh = 0.0  # cumulative
-
     print(f"[seed_history] Generating synthetic data from {start_date} to {end_date}...")
 
-    current_date = start_date
-    while current_date <= end_date:
-        day_start = datetime(
-            current_date.year, current_date.month, current_date.day, 0, 0, 0
-        )
-        for step in range(0, 24 * 60, STEP_MINUTES):
-            ts = day_start + timedelta(minutes=step)
-            minute_of_day = step
-
-            power = power_profile_for_minute(minute_of_day)
-            voltage = BASE_VOLTAGE + random.uniform(-4.0, 4.0)
-            current = power / voltage if voltage > 0 else 0.0
-
-            hours = STEP_MINUTES / 60.0
-            delta_kwh = (power * hours) / 1000.0
-            energy_kwh += delta_kwh
-
-            doc = {
-                "timestamp": ts,  # naive UTC datetime; your app converts ranges correctly
-                "device_id": DEVICE_ID,
-                "device_name": DEVICE_NAME,
-                "voltage": round(voltage, 2),
-                "current": round(current, 3),
-                "power": round(power, 1),
-                "energy_kWh": round(energy_kwh, 4),
-            }
-            docs.append(doc)
-
-        current_date += timedelta(days=1)
+    # One row per step for every day, built as whole columns.
+    day_minutes = np.arange(0, 24 * 60, STEP_MINUTES)
+    minutes = np.tile(day_minutes, PAST_DAYS)
+    day_index = np.repeat(np.arange(PAST_DAYS), len(day_minutes))
+    timestamps = (
+        np.datetime64(start_date, "m")
+        + (day_index * 24 * 60 + minutes).astype("timedelta64[m]")
+    )
 
-    return docs
+    n = len(minutes)
+    power = power_profile(minutes, rng)
+    voltage = BASE_VOLTAGE + rng.uniform(-4.0, 4.0, n)
+    current = np.divide(power, voltage, out=np.zeros(n), where=voltage > 0)
+
+    hours = STEP_MINUTES / 60.0
+    energy_kwh = np.cumsum(power * hours / 1000.0)  # cumulative
+
+    return [
+        {
+            "timestamp": ts,  # naive UTC datetime; your app converts ranges correctly
+            "device_id": DEVICE_ID,
+            "device_name": DEVICE_NAME,
+            "voltage": v,
+            "current": c,
+            "power": p,
+            "energy_kWh": e,
+        }
+        for ts, v, c, p, e in zip(
+            timestamps.astype("datetime64[us]").tolist(),
+            np.round(voltage, 2).tolist(),
+            np.round(current, 3).tolist(),
+            np.round(power, 1).tolist(),
+            np.round(energy_kwh, 4).tolist(),
+        )
+    ]
 
 
 def run_seed_if_needed():
-    if not SEED_OK:
+    if os.path.exists(SEED_MARKER):
+        return
+
+    readings_coll, meta_coll = _get_collections()
+    if readings_coll is None:
         print("[seed_history] Mongo not configured; skipping.")
         return
 
-    if _already_seeded():
+    if _already_seeded(meta_coll):
         print("[seed_history] History already seeded; nothing to do.")
+        _touch_marker()
         return
 
     docs = generate_docs()
@@ -168,9 +175,16 @@ def run_seed_if_needed():
         return
 
     print(f"[seed_history] Inserting {len(docs)} synthetic documents into MongoDB...")
-    result = readings_coll.insert_many(docs)
-    print(f"[seed_history] Inserted {len(result.inserted_ids)} docs.")
-    _mark_seeded()
+    # Synthetic data: unordered, unjournaled chunks are fine.
+    coll = readings_coll.with_options(write_concern=WriteConcern(w=1, j=False))
+    inserted = 0
+    for i in range(0, len(docs), INSERT_CHUNK):
+        result = coll.insert_many(
+            docs[i:i + INSERT_CHUNK], ordered=False, bypass_document_validation=True
+        )
+        inserted += len(result.inserted_ids)
+    print(f"[seed_history] Inserted {inserted} docs.")
+    _mark_seeded(meta_coll)
     print("[seed_history] Seeding complete; flag set to avoid reseeding.")
 
 
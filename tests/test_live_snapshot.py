@@ -0,0 +1,102 @@
+"""Poll-then-read behaviour of the device page's live snapshot.
+
+Runs against mongomock with the Tuya calls stubbed:
+
+    python -m unittest discover tests
+"""
+
+import unittest
+from datetime import datetime
+from unittest import mock
+
+try:
+    import mongomock
+except ImportError:  # pragma: no cover
+    mongomock = None
+
+import get_power_data
+import tuya_api_mongo
+
+
+def _status(power_w: float) -> dict:
+    return {
+        "success": True,
+        "result": [
+            {"code": "cur_voltage", "value": 2301},
+            {"code": "cur_power", "value": int(power_w * 10)},
+            {"code": "cur_current", "value": 240},
+            {"code": "add_ele", "value": 1234},
+        ],
+    }
+
+
+@unittest.skipIf(mongomock is None, "mongomock is not installed")
+class LiveSnapshotTest(unittest.TestCase):
+    def setUp(self):
+        patches = [
+            mock.patch.object(tuya_api_mongo, "_client", mongomock.MongoClient()),
+            mock.patch.object(tuya_api_mongo, "_coll_cache", {}),
+            # mongomock cannot create time-series collections.
+            mock.patch.object(tuya_api_mongo, "_create_timeseries", lambda db, name: None),
+            mock.patch.object(get_power_data, "get_token", lambda: "token"),
+            mock.patch.object(get_power_data, "_LAST_FETCH", {}),
+            mock.patch.object(get_power_data, "_LAST_RESULT", {}),
+        ]
+        for p in patches:
+            p.start()
+            self.addCleanup(p.stop)
+        tuya_api_mongo.latest_docs.clear()
+        self.addCleanup(tuya_api_mongo.latest_docs.clear)
+
+    def _poll(self, device_id: str, power_w: float) -> dict:
+        with mock.patch.object(
+            get_power_data, "get_device_status", lambda d, t: _status(power_w)
+        ):
+            return get_power_data.fetch_and_log_once(device_id, "Lab PC")
+
+    def test_poll_is_visible_to_the_next_read(self):
+        tuya_api_mongo.get_readings_collection("dev1").insert_one(
+            {
+                "timestamp": datetime(2026, 1, 1),
+                "voltage": 230.0,
+                "current": 0.1,
+                "power": 22.3,
+                "energy_kWh": 1.0,
+            }
+        )
+        # Warm the cache with the old reading, as the previous render would.
+        self.assertAlmostEqual(tuya_api_mongo.latest_docs("dev1")["power"].iloc[-1], 22.3, 3)
+
+        self.assertTrue(self._poll("dev1", 55.5).get("ok"))
+
+        df = tuya_api_mongo.latest_docs("dev1")
+        self.assertEqual(len(df), 2)
+        self.assertAlmostEqual(df["power"].iloc[-1], 55.5, 3)
+
+    def test_first_view_shows_the_first_poll(self):
+        self.assertTrue(self._poll("dev2", 40.0).get("ok"))
+
+        df = tuya_api_mongo.latest_docs("dev2")
+        self.assertEqual(len(df), 1)
+        self.assertAlmostEqual(df["power"].iloc[-1], 40.0, 3)
+
+    def test_empty_read_is_not_cached(self):
+        self.assertTrue(tuya_api_mongo.latest_docs("dev3").empty)
+
+        # Written behind the cache's back (e.g. by the collector process).
+        tuya_api_mongo.get_readings_collection("dev3").insert_one(
+            {
+                "timestamp": datetime(2026, 1, 1),
+                "voltage": 230.0,
+                "current": 0.1,
+                "power": 12.5,
+                "energy_kWh": 1.0,
+            }
+        )
+        df = tuya_api_mongo.latest_docs("dev3")
+        self.assertEqual(len(df), 1)
+        self.assertAlmostEqual(df["power"].iloc[-1], 12.5, 3)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -4,6 +4,7 @@ import json
 import hmac
 import hashlib
 import requests
+from requests.adapters import HTTPAdapter
 from dotenv import load_dotenv
 
 
@@ -28,6 +29,14 @@ ACCESS_SECRET = _get_secret("TUYA_ACCESS_SECRET", "")
 API_ENDPOINT = _get_secret("TUYA_API_ENDPOINT", "https://openapi.tuyaeu.com")
 HTTP_TIMEOUT = 15  # seconds
 
+# Keep-alive session so repeated calls reuse the TLS connection to Tuya.
+_SESSION = requests.Session()
+_SESSION.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=8))
+
+
+def close_session() -> None:
+    _SESSION.close()
+
 
 def _make_sign(client_id, secret, method, url, access_token: str = "", body: str = ""):
     t = str(int(time.time() * 1000))
@@ -49,7 +58,11 @@ def _make_sign(client_id, secret, method, url, access_token: str = "", body: str
     return sign, t
 
 
-_token_cache = {"value": None, "ts": 0.0, "ttl": 55.0}
+# Tuya tokens live for ~2 hours; refresh well before that.
+_token_cache = {"value": None, "ts": 0.0, "ttl": 3000.0}
+
+# Tuya error codes meaning the access token is invalid or expired.
+TOKEN_ERROR_CODES = (1010, 1011)
 
 
 def get_token() -> str:
@@ -68,7 +81,7 @@ def get_token() -> str:
         "t": t,
         "sign_method": "HMAC-SHA256",
     }
-    res = requests.get(API_ENDPOINT + path, headers=headers, timeout=HTTP_TIMEOUT)
+    res = _SESSION.get(API_ENDPOINT + path, headers=headers, timeout=HTTP_TIMEOUT)
     data = res.json()
     if not data.get("success"):
         raise RuntimeError(f"Failed to get Tuya token: {data}")
@@ -78,6 +91,15 @@ def get_token() -> str:
     return _token_cache["value"]
 
 
+def invalidate_token() -> None:
+    _token_cache["value"] = None
+    _token_cache["ts"] = 0.0
+
+
+def is_token_error(res: dict) -> bool:
+    return not res.get("success") and res.get("code") in TOKEN_ERROR_CODES
+
+
 def get_device_status(device_id: str, token: str) -> dict:
     path = f"/v1.0/devices/{device_id}/status"
     sign, t = _make_sign(ACCESS_ID, ACCESS_SECRET, "GET", path, token)
@@ -88,7 +110,7 @@ def get_device_status(device_id: str, token: str) -> dict:
         "access_token": token,
         "sign_method": "HMAC-SHA256",
     }
-    res = requests.get(API_ENDPOINT + path, headers=headers, timeout=HTTP_TIMEOUT)
+    res = _SESSION.get(API_ENDPOINT + path, headers=headers, timeout=HTTP_TIMEOUT)
     return res.json()
 
 
@@ -104,7 +126,7 @@ def control_device(device_id: str, token: str, code: str, value):
         "sign_method": "HMAC-SHA256",
         "Content-Type": "application/json",
     }
-    res = requests.post(
+    res = _SESSION.post(
         API_ENDPOINT + path, headers=headers, data=body, timeout=HTTP_TIMEOUT
     )
     return res.json()
\ No newline at end of file
@@ -1,12 +1,20 @@
+import atexit
+import functools
 import os
-from typing import Optional
+import queue
+import threading
+from typing import TYPE_CHECKING, Callable, Dict, List, Optional
 from datetime import datetime, timezone
 
-import pandas as pd
-from pymongo import MongoClient, ASCENDING, DESCENDING
+import numpy as np
+from pymongo import MongoClient, ASCENDING, DESCENDING, IndexModel
+from pymongo.collection import Collection
 from pymongo.errors import PyMongoError
 from dotenv import load_dotenv
 
+if TYPE_CHECKING:
+    import pandas as pd
+
 
 load_dotenv()
 
@@ -39,16 +47,61 @@ MONGODB_DB = _get_secret("MONGODB_DB", "tuya_energy")
 
 _client: Optional[MongoClient] = None
 
+# Fields the dashboard and billing read back; everything else stays in Mongo.
+READING_FIELDS = ("timestamp", "voltage", "current", "power", "energy_kWh")
+_READING_PROJECTION = {"_id": 0, **{f: 1 for f in READING_FIELDS}}
+# Instantaneous readings fit comfortably in float32; the cumulative energy
+# counter keeps float64 so small per-interval deltas survive subtraction.
+READING_DTYPES = {
+    "voltage": np.float32,
+    "current": np.float32,
+    "power": np.float32,
+    "energy_kWh": np.float64,
+}
+
+# pandas (and pymongoarrow, which imports it) are only loaded by the read
+# helpers, so the collector process that just writes never pays for them.
+_arrow = None
+
+
+def _get_arrow():
+    """(pymongoarrow.api, per-field Arrow types), or None if not installed."""
+    global _arrow
+    if _arrow is None:
+        try:
+            import pyarrow as pa
+            from pymongoarrow import api
+        except ImportError:
+            _arrow = False
+        else:
+            # Typed schemas let pymongoarrow decode BSON straight into Arrow
+            # columns. It only decodes float64, so results are narrowed to
+            # READING_DTYPES afterwards.
+            _arrow = (api, {
+                "timestamp": pa.timestamp("ms"),
+                "voltage": pa.float64(),
+                "current": pa.float64(),
+                "power": pa.float64(),
+                "energy_kWh": pa.float64(),
+            })
+    return _arrow or None
+
 
 def get_client() -> Optional[MongoClient]:
-    
+    # One pooled client per process; the module global outlives Streamlit
+    # reruns and is shared with data_collector.py.
     global _client
     if _client is None:
         if not MONGODB_URI:
             print("[Mongo] MONGODB_URI is empty. Check your .env or Streamlit secrets.")
             return None
         try:
-            _client = MongoClient(MONGODB_URI, tls=True)
+            _client = MongoClient(
+                MONGODB_URI,
+                tls=True,
+                maxPoolSize=20,
+                serverSelectionTimeoutMS=3000,
+            )
         except Exception as e:
             print(f"[Mongo] Error creating MongoClient: {e}")
             _client = None
@@ -67,66 +120,442 @@ def _get_db(client: MongoClient):
     return db
 
 
-def _get_collection(device_id: str):
+_READING_INDEXES = [IndexModel([("timestamp", ASCENDING)])]
+# Readings arrive every few seconds, so new per-device collections are
+# bucketed by MongoDB (5.0+) at "seconds" granularity.
+_READING_TIMESERIES = {
+    "timeField": "timestamp",
+    "metaField": "device_id",
+    "granularity": "seconds",
+}
+_coll_cache: Dict[str, Collection] = {}
+
+
+def _create_timeseries(db, name: str) -> None:
+    # Existing collections are left as they are; a server without
+    # time-series support (or a concurrent create) just falls through to
+    # the regular collection that the first insert creates.
+    try:
+        if not db.list_collection_names(filter={"name": name}):
+            db.create_collection(name, timeseries=_READING_TIMESERIES)
+    except PyMongoError as e:
+        print(f"[Mongo] time-series create skipped for {name}: {e}")
+
+
+def _ensure_indexes(coll: Collection) -> bool:
+    # Each collection holds a single device, so the timestamp index alone
+    # serves both latest_docs (walked backwards) and range_docs.
+    try:
+        coll.create_indexes(_READING_INDEXES)
+    except Exception:
+        return False
+    return True
+
+
+def _get_collection(device_id: str) -> Optional[Collection]:
+    coll = _coll_cache.get(device_id)
+    if coll is not None:
+        return coll
     client = get_client()
     if client is None:
         return None
     db = _get_db(client)
-    coll = db[f"readings_{device_id}"]
-    try:
-        coll.create_index([("timestamp", ASCENDING)])
-    except Exception:
-        pass
+    name = f"readings_{device_id}"
+    _create_timeseries(db, name)
+    coll = db[name]
+    # Only cache once the index is in place so a failed attempt is retried.
+    if _ensure_indexes(coll):
+        _coll_cache[device_id] = coll
     return coll
 
 
-def insert_reading(device_id: str, doc: dict):
-    coll = _get_collection(device_id)
-    if coll is None:
+def get_readings_collection(device_id: str) -> Optional[Collection]:
+    # Public entry point for writers outside this module (seed_history), so
+    # they get the same time-series creation and indexes as insert_reading.
+    return _get_collection(device_id)
+
+
+# Collector readings are queued and written in batches by a background
+# thread, every WRITE_INTERVAL or as soon as WRITE_BATCH_SIZE readings are
+# waiting. Interactive polls pass wait=True instead (see insert_reading).
+# The interval bounds how stale the collector's readings can be in Mongo (and
+# what a crash can lose); the live page never waits on it.
+WRITE_INTERVAL = 2.0  # seconds
+WRITE_BATCH_SIZE = 50
+
+_write_queue: "queue.Queue[tuple]" = queue.Queue()
+_write_wake = threading.Event()
+_writer: Optional[threading.Thread] = None
+_writer_lock = threading.Lock()
+
+
+def flush_all() -> None:
+    batches: Dict[str, List[dict]] = {}
+    while True:
+        try:
+            device_id, doc = _write_queue.get_nowait()
+        except queue.Empty:
+            break
+        batches.setdefault(device_id, []).append(doc)
+
+    for device_id, docs in batches.items():
+        try:
+            # First use creates the collection and indexes, which can fail on
+            # a flaky connection; nothing was written, so retry next tick.
+            coll = _get_collection(device_id)
+        except Exception as e:
+            print(f"[Mongo] insert_reading: re-queued {len(docs)} doc(s): {e}")
+            for doc in docs:
+                _write_queue.put((device_id, doc))
+            continue
+        if coll is None:
+            print("[Mongo] insert_reading: collection is None (no client/DB).")
+            continue
+        try:
+            coll.insert_many(docs, ordered=False)
+        except PyMongoError as e:
+            print(f"[Mongo] insert_reading error: {e}")
+        except Exception as e:
+            # e.g. bson InvalidDocument; drop this batch but keep the writer alive.
+            print(f"[Mongo] insert_reading dropped {len(docs)} doc(s): {e}")
+
+
+def _writer_loop() -> None:
+    while True:
+        _write_wake.wait(WRITE_INTERVAL)
+        _write_wake.clear()
+        flush_all()
+
+
+def _start_writer() -> None:
+    global _writer
+    with _writer_lock:
+        if _writer is None:
+            _writer = threading.Thread(target=_writer_loop, name="mongo-writer", daemon=True)
+            _writer.start()
+            atexit.register(flush_all)
+
+
+def insert_reading(device_id: str, doc: dict, wait: bool = False):
+    if get_client() is None:
         print("[Mongo] insert_reading: collection is None (no client/DB).")
         return
-    doc = dict(doc)
     ts = doc.get("timestamp")
-    if isinstance(ts, datetime) and ts.tzinfo is not None:
-        doc["timestamp"] = ts.astimezone(timezone.utc).replace(tzinfo=None)
-    try:
-        coll.insert_one(doc)
-    except PyMongoError as e:
-        print(f"[Mongo] insert_reading error: {e}")
+    tz = ts.tzinfo if isinstance(ts, datetime) else None
+    if tz is not None:
+        # Copy only when the timestamp has to be rewritten to naive UTC.
+        doc = dict(doc)
+        if tz is timezone.utc:
+            doc["timestamp"] = ts.replace(tzinfo=None)
+        else:
+            doc["timestamp"] = ts.astimezone(timezone.utc).replace(tzinfo=None)
+    if wait:
+        # The caller reads this reading back in the same script run (the live
+        # page), so write it now and drop the latest reads cached before it.
+        try:
+            coll = _get_collection(device_id)
+            if coll is None:
+                print("[Mongo] insert_reading: collection is None (no client/DB).")
+                return
+            coll.insert_one(doc)
+        except Exception as e:
+            print(f"[Mongo] insert_reading error: {e}")
+            return
+        latest_docs.clear()
+        latest_per_device.clear()
+        return
+    _write_queue.put((device_id, doc))
+    _start_writer()
+    if _write_queue.qsize() >= WRITE_BATCH_SIZE:
+        _write_wake.set()
+
+
+# Read caches live here so every caller (app pages, billing) shares them:
+# "latest" reads follow the poll cadence, history ranges change slowly.
+LATEST_CACHE_TTL = 5  # seconds
+RANGE_CACHE_TTL = 60  # seconds
+
+
+class _ReadMiss(Exception):
+    """Raised inside a cached read on an error or empty result."""
+
+
+def _empty_frame() -> "pd.DataFrame":
+    import pandas as pd
+
+    return pd.DataFrame()
 
 
-def latest_docs(device_id: str, n: int = 50) -> pd.DataFrame:
+def _cached_read(ttl: int, empty: Callable[[], object]):
+    # st.cache_data only stores returned values, so misses raise _ReadMiss
+    # inside the cached function and become empty() out here: a transient
+    # Mongo error or a not-yet-written device is retried on the next call.
+    def decorate(fn):
+        cached = st.cache_data(ttl=ttl, show_spinner=False)(fn)
+
+        @functools.wraps(fn)
+        def read(*args, **kwargs):
+            try:
+                return cached(*args, **kwargs)
+            except _ReadMiss:
+                return empty()
+
+        read.clear = cached.clear
+        return read
+
+    return decorate
+
+
+@_cached_read(LATEST_CACHE_TTL, _empty_frame)
+def latest_docs(device_id: str, n: int = 50) -> "pd.DataFrame":
+    import pandas as pd
+
     coll = _get_collection(device_id)
     if coll is None:
-        return pd.DataFrame()
+        raise _ReadMiss
     try:
         docs = list(
-            coll.find({}, sort=[("timestamp", DESCENDING)], limit=int(n))
+            coll.find(
+                {}, _READING_PROJECTION, sort=[("timestamp", DESCENDING)], limit=int(n)
+            )
         )
     except PyMongoError as e:
         print(f"[Mongo] latest_docs error: {e}")
-        return pd.DataFrame()
+        raise _ReadMiss
     if not docs:
-        return pd.DataFrame()
-    df = pd.DataFrame(docs)
-    if "_id" in df.columns:
-        df.drop(columns=["_id"], inplace=True)
-    return df.sort_values("timestamp")
+        raise _ReadMiss
+    # Newest-first from the index walk; flip to chronological order.
+    docs.reverse()
+    return pd.DataFrame.from_records(docs, columns=READING_FIELDS).astype(READING_DTYPES)
+
+
+def _read_columns(coll, query: dict, fields) -> Optional[Dict[str, list]]:
+    cols = {f: [] for f in fields}
+    appends = [(f, cols[f].append) for f in fields]
+    try:
+        cursor = (
+            coll.find(query, {"_id": 0, **{f: 1 for f in fields}})
+            .sort("timestamp", ASCENDING)
+            .batch_size(2000)
+        )
+        for doc in cursor:
+            for f, append in appends:
+                append(doc.get(f))
+    except PyMongoError as e:
+        print(f"[Mongo] range query error: {e}")
+        return None
+    return cols
+
 
+@_cached_read(RANGE_CACHE_TTL, _empty_frame)
+def range_docs(device_id: str, start: datetime, end: datetime) -> "pd.DataFrame":
+    import pandas as pd
 
-def range_docs(device_id: str, start: datetime, end: datetime) -> pd.DataFrame:
     coll = _get_collection(device_id)
     if coll is None:
-        return pd.DataFrame()
+        raise _ReadMiss
     query = {"timestamp": {"$gte": start, "$lte": end}}
+    arrow = _get_arrow()
+    if arrow is not None:
+        api, types = arrow
+        try:
+            df = api.find_pandas_all(
+                coll, query, schema=api.Schema(types), sort=[("timestamp", ASCENDING)]
+            )
+        except PyMongoError as e:
+            print(f"[Mongo] range_docs error: {e}")
+            raise _ReadMiss
+        except Exception as e:
+            print(f"[Mongo] range_docs Arrow read failed, using cursor: {e}")
+        else:
+            if df.empty:
+                raise _ReadMiss
+            return df.astype(READING_DTYPES)
+
+    cols = _read_columns(coll, query, READING_FIELDS)
+    if not cols or not cols["timestamp"]:
+        raise _ReadMiss
+    return pd.DataFrame(cols).astype(READING_DTYPES)
+
+
+def _bucket_pipeline(start: datetime, end: datetime, seconds: int) -> list:
+    # Epoch-aligned fixed-size buckets: means for the instantaneous fields,
+    # max for the cumulative energy counter.
+    ts_ms = {"$toLong": "$timestamp"}
+    bucket = {"$toDate": {"$subtract": [ts_ms, {"$mod": [ts_ms, int(seconds) * 1000]}]}}
+    return [
+        {"$match": {"timestamp": {"$gte": start, "$lte": end}}},
+        {
+            "$group": {
+                "_id": bucket,
+                "power": {"$avg": "$power"},
+                "voltage": {"$avg": "$voltage"},
+                "current": {"$avg": "$current"},
+                "energy_kWh": {"$max": "$energy_kWh"},
+            }
+        },
+        {"$sort": {"_id": ASCENDING}},
+        {"$project": {"_id": 0, "timestamp": "$_id", **{f: 1 for f in READING_FIELDS[1:]}}},
+    ]
+
+
+def range_arrays(
+    device_id: str,
+    start: datetime,
+    end: datetime,
+    fields=("timestamp", "power", "voltage"),
+    bucket_seconds: Optional[int] = None,
+) -> Dict[str, np.ndarray]:
+    # Same data as range_docs (or range_docs_bucketed when bucket_seconds is
+    # set), returned as one NumPy array per field so numeric code can skip
+    # building a DataFrame per device.
+    coll = _get_collection(device_id)
+    if coll is None:
+        return {}
+    query = {"timestamp": {"$gte": start, "$lte": end}}
+    arrow = _get_arrow()
+    if arrow is not None:
+        api, types = arrow
+        schema = api.Schema({f: types[f] for f in fields})
+        try:
+            if bucket_seconds:
+                pipeline = _bucket_pipeline(start, end, bucket_seconds)
+                arrays = api.aggregate_numpy_all(coll, pipeline, schema=schema)
+            else:
+                arrays = api.find_numpy_all(
+                    coll, query, schema=schema, sort=[("timestamp", ASCENDING)]
+                )
+        except PyMongoError as e:
+            print(f"[Mongo] range_arrays error: {e}")
+            return {}
+        except Exception as e:
+            print(f"[Mongo] range_arrays Arrow read failed, using cursor: {e}")
+        else:
+            if not len(arrays["timestamp"]):
+                return {}
+            return {
+                f: a.astype(READING_DTYPES[f]) if f in READING_DTYPES else a
+                for f, a in arrays.items()
+            }
+
+    try:
+        if bucket_seconds:
+            docs = list(coll.aggregate(_bucket_pipeline(start, end, bucket_seconds)))
+            cols = {f: [d.get(f) for d in docs] for f in fields}
+        else:
+            cols = _read_columns(coll, query, fields)
+    except PyMongoError as e:
+        print(f"[Mongo] range_arrays error: {e}")
+        return {}
+    if not cols or not cols["timestamp"]:
+        return {}
+    return {
+        f: np.array(v, dtype=READING_DTYPES.get(f, "datetime64[ms]"))
+        for f, v in cols.items()
+    }
+
+
+@_cached_read(RANGE_CACHE_TTL, _empty_frame)
+def range_docs_bucketed(
+    device_id: str, start: datetime, end: datetime, seconds: int
+) -> "pd.DataFrame":
+    import pandas as pd
+
+    coll = _get_collection(device_id)
+    if coll is None:
+        raise _ReadMiss
+    pipeline = _bucket_pipeline(start, end, seconds)
+    arrow = _get_arrow()
+    if arrow is not None:
+        api, types = arrow
+        try:
+            df = api.aggregate_pandas_all(coll, pipeline, schema=api.Schema(types))
+        except PyMongoError as e:
+            print(f"[Mongo] range_docs_bucketed error: {e}")
+            raise _ReadMiss
+        except Exception as e:
+            print(f"[Mongo] range_docs_bucketed Arrow read failed, using cursor: {e}")
+        else:
+            if df.empty:
+                raise _ReadMiss
+            return df.astype(READING_DTYPES)
+    try:
+        docs = list(coll.aggregate(pipeline))
+    except PyMongoError as e:
+        print(f"[Mongo] range_docs_bucketed error: {e}")
+        raise _ReadMiss
+    if not docs:
+        raise _ReadMiss
+    return pd.DataFrame.from_records(docs, columns=READING_FIELDS).astype(READING_DTYPES)
+
+
+def _aggregate_per_device(device_ids: List[str], stages: Callable[[str], list]) -> List[dict]:
+    # Readings live in one collection per device; chain them with $unionWith
+    # so the whole fleet is answered in a single round-trip.
+    ids = [did for did in dict.fromkeys(device_ids) if did]
+    if not ids:
+        return []
+    coll = _get_collection(ids[0])
+    if coll is None:
+        return []
+    pipeline = list(stages(ids[0]))
+    for did in ids[1:]:
+        pipeline.append(
+            {"$unionWith": {"coll": f"readings_{did}", "pipeline": stages(did)}}
+        )
     try:
-        docs = list(coll.find(query).sort("timestamp", ASCENDING))
+        return list(coll.aggregate(pipeline))
     except PyMongoError as e:
-        print(f"[Mongo] range_docs error: {e}")
-        return pd.DataFrame()
+        print(f"[Mongo] aggregate error: {e}")
+        return []
+
+
+@_cached_read(LATEST_CACHE_TTL, dict)
+def latest_per_device(device_ids: List[str]) -> Dict[str, dict]:
+    def stages(did: str) -> list:
+        return [
+            {"$sort": {"timestamp": DESCENDING}},
+            {"$limit": 1},
+            {"$project": {"_id": 0}},
+            {"$set": {"device_id": did}},
+        ]
+
+    docs = _aggregate_per_device(device_ids, stages)
     if not docs:
-        return pd.DataFrame()
-    df = pd.DataFrame(docs)
-    if "_id" in df.columns:
-        df.drop(columns=["_id"], inplace=True)
-    return df
+        raise _ReadMiss
+    return {d["device_id"]: d for d in docs}
+
+
+def energy_bounds_per_device(
+    device_ids: List[str],
+    day_start: datetime,
+    day_end: datetime,
+    month_start: datetime,
+    month_end: datetime,
+) -> Dict[str, dict]:
+    # Min/max of the cumulative energy counter per device for the month and
+    # for the day inside it, all in one round-trip.
+    in_day = {
+        "$and": [
+            {"$gte": ["$timestamp", day_start]},
+            {"$lte": ["$timestamp", day_end]},
+        ]
+    }
+    day_energy = {"$cond": [in_day, "$energy_kWh", None]}
+
+    def stages(did: str) -> list:
+        return [
+            {"$match": {"timestamp": {"$gte": month_start, "$lte": month_end}}},
+            {
+                "$group": {
+                    "_id": {"$literal": did},
+                    "month_min": {"$min": "$energy_kWh"},
+                    "month_max": {"$max": "$energy_kWh"},
+                    "day_min": {"$min": day_energy},
+                    "day_max": {"$max": day_energy},
+                }
+            },
+        ]
+
+    docs = _aggregate_per_device(device_ids, stages)
+    return {d["_id"]: d for d in docs}